@@ -1,37 +1,71 @@
 from kokoro import KModel, KPipeline
 import gradio as gr
+import array
+import asyncio
+import collections
+import functools
+import mmap
+import numpy as np
 import os
 import random
 import torch
+import locale
 import logging
+import logging.handlers
+import atexit
 import datetime
+import queue
 import sys
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor
 
 # Setup logging
 log_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
 os.makedirs(log_directory, exist_ok=True)
 log_filename = os.path.join(log_directory, f'kokoro_tts_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.log')
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_filename),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+# Configure logging; records are written by a listener thread, off the request path
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+log_handlers = [logging.FileHandler(log_filename), logging.StreamHandler(sys.stdout)]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers)
+queue_handler = logging.handlers.QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger('kokoro_tts')
 
 # Configuration constants
 IS_DUPLICATE = not os.getenv('SPACE_ID', '').startswith('c:/kuku')
 CHAR_LIMIT = None if IS_DUPLICATE else 500000
+BATCH_SIZE = 8
+BATCH_WAIT = 0.02
+CACHE_MAX = 64
+STREAM_CACHE_MAX = 16
+G2P_AHEAD = 2
+STREAM_BATCH = 4
+USE_BF16 = os.getenv('KOKORO_BF16', '1') == '1'
+USE_COMPILE = os.getenv('KOKORO_COMPILE', '0') == '1'
+USE_INT8 = os.getenv('KOKORO_INT8', '0') == '1'
+# Work around the Gradio bug where the first streamed chunk may not play
+NEED_ZERO_BUF = os.getenv('KOKORO_GRADIO_ZERO_BUG', '1') == '1'
 
 # Check CUDA availability
 CUDA_AVAILABLE = False
-logger.info(f"CUDA available: {CUDA_AVAILABLE}")
-logger.info(f"Character limit: {CHAR_LIMIT}")
-logger.info(f"Is duplicate: {IS_DUPLICATE}")
+logger.info("CUDA available: %s", CUDA_AVAILABLE)
+logger.info("Character limit: %s", CHAR_LIMIT)
+logger.info("Is duplicate: %s", IS_DUPLICATE)
+logger.info("bf16 autocast requested: %s", USE_BF16)
+logger.info("torch.compile: %s, int8 Linear: %s", USE_COMPILE, USE_INT8)
+logger.info("Stream zero-buffer workaround: %s", NEED_ZERO_BUF)
+
+# Use every core for a single forward; concurrent forwards are serialized by _infer_lock
+torch.set_num_threads(os.cpu_count() or 1)
+_infer_lock = threading.Lock()
 
 # Initialize models
 logger.info("Initializing models...")
@@ -41,8 +75,21 @@ models = {
     .eval()
     for gpu in [False]
 }
+if USE_INT8:
+    logger.info("Quantizing Linear layers to int8")
+    models[False] = torch.ao.quantization.quantize_dynamic(models[False], {torch.nn.Linear}, dtype=torch.qint8)
 logger.info("Models initialized successfully")
 
+# Eager encoder and vocoder; swapped for compiled versions by the warm-up below
+_bert, _decoder = models[False].bert, models[False].decoder
+
+# Silent one-sample buffer yielded after the first streamed segment
+_ZERO_BUF = np.zeros(1, dtype=np.int16)
+
+# Convert a float waveform to int16 PCM, which gr.Audio takes as-is at 24 kHz
+def to_pcm16(audio):
+    return audio.detach().clamp(-1, 1).mul_(32767).to(torch.int16).numpy()
+
 # Initialize pipelines
 logger.info("Initializing pipelines...")
 pipelines = {lang_code: KPipeline(lang_code=lang_code, model=False) for lang_code in 'ab'}
@@ -50,142 +97,424 @@ pipelines['a'].g2p.lexicon.golds['kokoro'] = 'kˈOkəɹO'
 pipelines['b'].g2p.lexicon.golds['kokoro'] = 'kˈQkəɹQ'
 logger.info("Pipelines initialized successfully")
 
-# Model forward function for GPU
+# One G2P worker thread per language; it round-robins one segment at a time over every
+# active request, so a short request is never stuck behind a long stream
+def _g2p_worker(pipeline, requests, wake):
+    active = []
+    def finish(job):
+        active.remove(job)
+        job.segments.close()
+        job.put(None)
+    while True:
+        pending = [] if active else [requests.get()]
+        while True:
+            try:
+                pending.append(requests.get_nowait())
+            except queue.Empty:
+                break
+        for text, voice, speed, limit, put, stop, credits in pending:
+            active.append(types.SimpleNamespace(segments=pipeline(text, voice, speed), limit=limit, count=0, put=put, stop=stop, credits=credits))
+        wake.clear()
+        progressed = False
+        for job in list(active):
+            if job.stop.is_set():
+                finish(job)
+                continue
+            if not job.credits.acquire(blocking=False):
+                continue
+            progressed = True
+            try:
+                segment = next(job.segments)
+            except StopIteration:
+                finish(job)
+                continue
+            except Exception as e:
+                logger.error("Error during tokenization: %s", e)
+                job.put(e)
+                finish(job)
+                continue
+            job.put(segment)
+            job.count += 1
+            if job.count == job.limit:
+                finish(job)
+        if active and not progressed:
+            wake.wait(0.1)
+
+_g2p_queues = {lang_code: queue.Queue() for lang_code in pipelines}
+_g2p_wakes = {lang_code: threading.Event() for lang_code in pipelines}
+for lang_code, pipeline in pipelines.items():
+    threading.Thread(target=_g2p_worker, args=(pipeline, _g2p_queues[lang_code], _g2p_wakes[lang_code]), name=f'g2p-{lang_code}', daemon=True).start()
+
+# Tokenize on the voice's G2P worker and yield segments as they become ready; the worker
+# stays at most G2P_AHEAD segments ahead of the consumer
+async def g2p_segments(text, voice, speed=1, limit=None):
+    loop = asyncio.get_running_loop()
+    out = asyncio.Queue()
+    stop = threading.Event()
+    credits = threading.Semaphore(G2P_AHEAD)
+    wake = _g2p_wakes[voice[0]]
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(out.put_nowait, item)
+        except RuntimeError:
+            stop.set()
+    _g2p_queues[voice[0]].put((text, voice, speed, limit, put, stop, credits))
+    wake.set()
+    try:
+        while (segment := await out.get()) is not None:
+            if isinstance(segment, Exception):
+                raise segment
+            credits.release()
+            wake.set()
+            yield segment
+    finally:
+        stop.set()
+        wake.set()
+
+# Resolve a voice pack once per voice instead of per request; a miss downloads and loads
+# the pack, so async handlers call it from an executor
+@functools.lru_cache(maxsize=32)
+def _pack_for(voice):
+    return pipelines[voice[0]].load_voice(voice)
+
+# Model forward function for GPU; blocks on _infer_lock, so call it from an executor
 def forward_gpu(ps, ref_s, speed):
-    logger.debug(f"Running forward_gpu with speed {speed}")
-    return models[True](ps, ref_s, speed)
+    logger.debug("Running forward_gpu with speed %s", speed)
+    with _infer_lock:
+        return models[True](ps, ref_s, speed)
+
+# Run one padded CPU forward over several (ps, ref_s, speed) requests; if the batched
+# path failed its startup parity check, fall back to the stock KModel.forward per request
+def forward_batch(batch):
+    if not _batch_parity_ok:
+        with _infer_lock, torch.inference_mode():
+            return [models[False](ps, ref_s, speed) for ps, ref_s, speed in batch]
+    return _forward_batch(batch, bf16=_bf16_ok)
+
+# Text-side modules run padded over the whole batch; prosody and vocoder run per row,
+# because their LSTMs and instance norms would otherwise see the padding
+@torch.inference_mode()
+def _forward_batch(batch, bf16):
+    model = models[False]
+    ids = [torch.LongTensor([0, *(i for i in map(model.vocab.get, ps) if i is not None), 0]) for ps, _, _ in batch]
+    input_lengths = torch.LongTensor([len(i) for i in ids])
+    input_ids = torch.nn.utils.rnn.pad_sequence(ids, batch_first=True).to(model.device)
+    text_mask = torch.arange(input_lengths.max()).unsqueeze(0).expand(len(ids), -1)
+    text_mask = torch.gt(text_mask+1, input_lengths.unsqueeze(1)).to(model.device)
+    ref_s = torch.stack([ref_s for _, ref_s, _ in batch]).squeeze(1).to(model.device)
+    speed = torch.tensor([[float(speed)] for _, _, speed in batch], device=model.device)
+    audios = []
+    with _infer_lock, torch.autocast('cpu', dtype=torch.bfloat16, enabled=bf16):
+        bert_dur = _bert(input_ids, attention_mask=(~text_mask).int())
+        d_en = model.bert_encoder(bert_dur).transpose(-1, -2)
+        s = ref_s[:, 128:]
+        d = model.predictor.text_encoder(d_en, s, input_lengths.to(model.device), text_mask)
+        x = torch.nn.utils.rnn.pack_padded_sequence(d, input_lengths, batch_first=True, enforce_sorted=False)
+        x, _ = model.predictor.lstm(x)
+        x, _ = torch.nn.utils.rnn.pad_packed_sequence(x, batch_first=True, total_length=d.shape[1])
+        duration = torch.sigmoid(model.predictor.duration_proj(x)).sum(axis=-1) / speed
+        pred_dur = torch.round(duration).clamp(min=1).long()
+        t_en = model.text_encoder(input_ids, input_lengths.to(model.device), text_mask)
+        for row, n in enumerate(input_lengths.tolist()):
+            indices = torch.repeat_interleave(torch.arange(n, device=model.device), pred_dur[row, :n])
+            pred_aln_trg = torch.zeros((n, indices.shape[0]), device=model.device)
+            pred_aln_trg[indices, torch.arange(indices.shape[0], device=model.device)] = 1
+            pred_aln_trg = pred_aln_trg.unsqueeze(0)
+            en = d[row:row+1, :n].transpose(-1, -2) @ pred_aln_trg
+            F0_pred, N_pred = model.predictor.F0Ntrain(en, s[row:row+1])
+            asr = t_en[row:row+1, :, :n] @ pred_aln_trg
+            # The iSTFT vocoder needs fp32 complex math, so it always runs outside autocast
+            with torch.autocast('cpu', enabled=False):
+                audio = _decoder(asr.float(), F0_pred.float(), N_pred.float(), ref_s[row:row+1, :128])
+            audios.append(audio.squeeze().cpu())
+    return audios
+
+# Shared request queue drained by the batching coroutine
+_batch_queue = asyncio.Queue()
+_batcher_task = None
+
+# Collect concurrent requests into batches and resolve their futures
+async def _batcher():
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _batch_queue.get()]
+        deadline = loop.time() + BATCH_WAIT
+        while len(batch) < BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_batch_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        batch = [item for item in batch if not item[3].cancelled()]
+        if not batch:
+            continue
+        logger.debug("Running batched forward for %d requests", len(batch))
+        await _run_batch(loop, batch)
+
+# Run a batch and resolve its futures, retrying rows one by one if the batch fails
+async def _run_batch(loop, batch):
+    try:
+        results = await loop.run_in_executor(None, forward_batch, [item[:3] for item in batch])
+    except Exception as e:
+        if len(batch) > 1:
+            logger.warning("Batched forward failed, retrying %d requests one at a time: %s", len(batch), e)
+            for item in batch:
+                await _run_batch(loop, [item])
+            return
+        logger.error("Error during batched generation: %s", e)
+        future = batch[0][3]
+        if not future.done():
+            future.set_exception(e)
+        return
+    for (*_, future), audio in zip(batch, results):
+        if not future.done():
+            future.set_result(audio)
+
+# Queue a CPU forward and wait for its batched result
+async def _submit(ps, ref_s, speed):
+    global _batcher_task
+    if _batcher_task is None or _batcher_task.done():
+        _batcher_task = asyncio.get_running_loop().create_task(_batcher())
+    future = asyncio.get_running_loop().create_future()
+    await _batch_queue.put((ps, ref_s, speed, future))
+    return await future
+
+# LRU caches of synthesized audio: Generate results keyed on (text, voice, speed), and a
+# smaller one for streamed segments keyed on (text, voice, speed, index)
+_synth_cache = collections.OrderedDict()
+_stream_cache = collections.OrderedDict()
+
+def _cache_get(cache, key):
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+def _cache_put(cache, key, value, max_size):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > max_size:
+        cache.popitem(last=False)
 
 # Generate first audio segment
-def generate_first(text, voice='af_heart', speed=1, use_gpu=CUDA_AVAILABLE):
-    logger.info(f"Generating first audio segment for voice: {voice}, speed: {speed}, use_gpu: {use_gpu}")
+async def generate_first(text, voice='af_heart', speed=1, use_gpu=CUDA_AVAILABLE):
+    logger.info("Generating first audio segment for voice: %s, speed: %s, use_gpu: %s", voice, speed, use_gpu)
     text = text if CHAR_LIMIT is None else text.strip()[:CHAR_LIMIT]
-    logger.debug(f"Text length: {len(text)} characters")
+    logger.debug("Text length: %d characters", len(text))
     
-    pipeline = pipelines[voice[0]]
-    pack = pipeline.load_voice(voice)
+    key = (text, voice, speed)
+    cached = _cache_get(_synth_cache, key)
+    if cached is not None:
+        logger.info("Returning cached audio")
+        audio, ps = cached
+        return (24000, audio), ps
+    
+    pack = await asyncio.get_running_loop().run_in_executor(None, _pack_for, voice)
     use_gpu = use_gpu and CUDA_AVAILABLE
     
-    for _, ps, _ in pipeline(text, voice, speed):
+    async for _, ps, _ in g2p_segments(text, voice, speed, limit=1):
         ref_s = pack[len(ps)-1]
         try:
             if use_gpu:
                 logger.debug("Using GPU for generation")
-                audio = forward_gpu(ps, ref_s, speed)
+                audio = await asyncio.get_running_loop().run_in_executor(None, forward_gpu, ps, ref_s, speed)
             else:
                 logger.debug("Using CPU for generation")
-                audio = models[False](ps, ref_s, speed)
+                audio = await _submit(ps, ref_s, speed)
         except gr.exceptions.Error as e:
-            logger.error(f"Error during generation: {str(e)}")
+            logger.error("Error during generation: %s", e)
             if use_gpu:
                 logger.warning("GPU error, retrying with CPU")
                 gr.Warning(str(e))
                 gr.Info('Retrying with CPU. To avoid this error, change Hardware to CPU.')
-                audio = models[False](ps, ref_s, speed)
+                audio = await _submit(ps, ref_s, speed)
             else:
                 logger.error("CPU error, cannot continue")
                 raise gr.Error(e)
         
         logger.info("Audio generation successful")
-        return (24000, audio.numpy()), ps
+        audio = to_pcm16(audio)
+        _cache_put(_synth_cache, key, (audio, ps), CACHE_MAX)
+        return (24000, audio), ps
     
     logger.warning("No audio generated")
     return None, ''
 
 # Arena API prediction function
-def predict(text, voice='af_heart', speed=1):
-    logger.info(f"API prediction request for voice: {voice}, speed: {speed}")
-    return generate_first(text, voice, speed, use_gpu=False)[0]
+async def predict(text, voice='af_heart', speed=1):
+    logger.info("API prediction request for voice: %s, speed: %s", voice, speed)
+    return (await generate_first(text, voice, speed, use_gpu=False))[0]
 
 # Tokenize first text segment
-def tokenize_first(text, voice='af_heart'):
-    logger.info(f"Tokenizing text for voice: {voice}")
-    pipeline = pipelines[voice[0]]
-    for _, ps, _ in pipeline(text, voice):
-        logger.debug(f"Tokenization result length: {len(ps)}")
+async def tokenize_first(text, voice='af_heart'):
+    logger.info("Tokenizing text for voice: %s", voice)
+    async for _, ps, _ in g2p_segments(text, voice, limit=1):
+        logger.debug("Tokenization result length: %d", len(ps))
         return ps
     
     logger.warning("No tokens generated")
     return ''
 
-# Generate all audio segments (streaming)
-def generate_all(text, voice='af_heart', speed=1, use_gpu=CUDA_AVAILABLE):
-    logger.info(f"Streaming audio generation for voice: {voice}, speed: {speed}, use_gpu: {use_gpu}")
-    text = text if CHAR_LIMIT is None else text.strip()[:CHAR_LIMIT]
-    logger.debug(f"Text length: {len(text)} characters")
-    
-    pipeline = pipelines[voice[0]]
-    pack = pipeline.load_voice(voice)
-    use_gpu = use_gpu and CUDA_AVAILABLE
-    first = True
-    segment_count = 0
-    
-    for _, ps, _ in pipeline(text, voice, speed):
-        segment_count += 1
-        logger.debug(f"Generating segment {segment_count}")
+# Synthesize one streamed segment, reusing its cached audio when present
+async def _stream_segment(text, voice, speed, use_gpu, pack, index, ps):
+    logger.debug("Generating segment %d", index)
+    key = (text, voice, speed, index)
+    audio = _cache_get(_stream_cache, key)
+    if audio is None:
         ref_s = pack[len(ps)-1]
         try:
             if use_gpu:
                 logger.debug("Using GPU for streaming generation")
-                audio = forward_gpu(ps, ref_s, speed)
+                audio = await asyncio.get_running_loop().run_in_executor(None, forward_gpu, ps, ref_s, speed)
             else:
                 logger.debug("Using CPU for streaming generation")
-                audio = models[False](ps, ref_s, speed)
+                audio = await _submit(ps, ref_s, speed)
         except gr.exceptions.Error as e:
-            logger.error(f"Error during streaming generation: {str(e)}")
+            logger.error("Error during streaming generation: %s", e)
             if use_gpu:
                 logger.warning("GPU error in streaming, switching to CPU")
                 gr.Warning(str(e))
                 gr.Info('Switching to CPU')
-                audio = models[False](ps, ref_s, speed)
+                audio = await _submit(ps, ref_s, speed)
             else:
                 logger.error("CPU error in streaming, cannot continue")
                 raise gr.Error(e)
-        
-        logger.debug(f"Successfully generated segment {segment_count}")
-        yield 24000, audio.numpy()
-        if first:
-            first = False
-            logger.debug("Yielding zero buffer after first segment")
-            yield 24000, torch.zeros(1).numpy()
+        audio = to_pcm16(audio)
+        _cache_put(_stream_cache, key, audio, STREAM_CACHE_MAX)
     
-    logger.info(f"Completed streaming with {segment_count} segments")
+    logger.debug("Successfully generated segment %d", index)
+    return audio
+
+# Group phoneme segments: the first alone for a fast first chunk, then doubling up to STREAM_BATCH
+async def _group_segments(segments):
+    group, size = [], 1
+    async for _, ps, _ in segments:
+        group.append(ps)
+        if len(group) == size:
+            yield group
+            group, size = [], min(size * 2, STREAM_BATCH)
+    if group:
+        yield group
+
+# Start each group's forwards as soon as its segments are ready, one group ahead of the consumer
+async def _schedule_groups(text, voice, speed, use_gpu, pack, pending):
+    index = 0
+    try:
+        async for group in _group_segments(g2p_segments(text, voice, speed)):
+            # Submitted together, the CPU forwards of a group share one batched forward
+            task = asyncio.gather(*(
+                _stream_segment(text, voice, speed, use_gpu, pack, index + i, ps)
+                for i, ps in enumerate(group, 1)
+            ))
+            # A group cancelled on disconnect would otherwise log "exception was never retrieved"
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            index += len(group)
+            try:
+                await pending.put(task)
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+    except Exception as e:
+        await pending.put(e)
+    await pending.put(None)
+
+# Generate all audio segments (streaming)
+async def generate_all(text, voice='af_heart', speed=1, use_gpu=CUDA_AVAILABLE):
+    logger.info("Streaming audio generation for voice: %s, speed: %s, use_gpu: %s", voice, speed, use_gpu)
+    text = text if CHAR_LIMIT is None else text.strip()[:CHAR_LIMIT]
+    logger.debug("Text length: %d characters", len(text))
+    
+    pack = await asyncio.get_running_loop().run_in_executor(None, _pack_for, voice)
+    use_gpu = use_gpu and CUDA_AVAILABLE
+    first = NEED_ZERO_BUF
+    segment_count = 0
+    pending = asyncio.Queue(maxsize=1)
+    task = None
+    scheduler = asyncio.ensure_future(_schedule_groups(text, voice, speed, use_gpu, pack, pending))
+    
+    try:
+        while (task := await pending.get()) is not None:
+            if isinstance(task, Exception):
+                raise task
+            for audio in await task:
+                segment_count += 1
+                yield 24000, audio
+                if first:
+                    first = False
+                    logger.debug("Yielding zero buffer after first segment")
+                    yield 24000, _ZERO_BUF
+    finally:
+        scheduler.cancel()
+        if isinstance(task, asyncio.Future):
+            task.cancel()
+        while not pending.empty():
+            if isinstance(task := pending.get_nowait(), asyncio.Future):
+                task.cancel()
+    
+    logger.info("Completed streaming with %d segments", segment_count)
+
+# Map the quote file once and index the start of every non-empty line
+def _index_quotes(path):
+    offsets = array.array('Q')
+    try:
+        with open(path, 'rb') as r:
+            mm = mmap.mmap(r.fileno(), 0, access=mmap.ACCESS_READ)
+        pos = 0
+        while pos < len(mm):
+            nl = mm.find(b'\n', pos)
+            if nl == -1:
+                nl = len(mm)
+            if mm[pos:nl].strip():
+                offsets.append(pos)
+            pos = nl + 1
+        logger.info("Indexed %d quotes", len(offsets))
+        return mm, offsets
+    except Exception as e:
+        logger.error("Error indexing quotes: %s", e)
+        return None, offsets
+
+_quotes_mm, _quote_offsets = _index_quotes(r'C:\kuku\Kokoro-TTS\en.txt')
+# The file used to be read in text mode, i.e. with the locale encoding
+_QUOTES_ENCODING = locale.getpreferredencoding(False)
 
 # Get random quote from file
 def get_random_quote():
     logger.info("Getting random quote")
     try:
-        with open(r'C:\kuku\Kokoro-TTS\en.txt', 'r') as r:
-            random_quotes = [line.strip() for line in r]
-        quote = random.choice(random_quotes)
-        logger.debug(f"Selected random quote of length {len(quote)}")
+        start = _quote_offsets[random.randrange(len(_quote_offsets))]
+        end = _quotes_mm.find(b'\n', start)
+        quote = _quotes_mm[start:end if end != -1 else len(_quotes_mm)].decode(_QUOTES_ENCODING, errors='replace').strip()
+        logger.debug("Selected random quote of length %d", len(quote))
         return quote
     except Exception as e:
-        logger.error(f"Error getting random quote: {str(e)}")
+        logger.error("Error getting random quote: %s", e)
         return "Error loading quote."
 
-# Get Gatsby sample
-def get_gatsby():
-    logger.info("Getting Gatsby sample")
+# Read a static demo sample once at import
+def _load_sample(path, name):
     try:
-        with open(r'C:\kuku\Kokoro-TTS\gatsby5k.md', 'r') as r:
+        with open(path, 'r') as r:
             text = r.read().strip()
-        logger.debug(f"Loaded Gatsby sample of length {len(text)}")
+        logger.info("Loaded %s sample of length %d", name, len(text))
         return text
     except Exception as e:
-        logger.error(f"Error getting Gatsby sample: {str(e)}")
-        return "Error loading Gatsby sample."
+        logger.error("Error loading %s sample: %s", name, e)
+        return f"Error loading {name} sample."
+
+_GATSBY_TEXT = _load_sample(r'C:\kuku\Kokoro-TTS\gatsby5k.md', 'Gatsby')
+_FRANKENSTEIN_TEXT = _load_sample(r'C:\kuku\Kokoro-TTS\frankenstein5k.md', 'Frankenstein')
+
+# Get Gatsby sample
+def get_gatsby():
+    logger.info("Getting Gatsby sample")
+    return _GATSBY_TEXT
 
 # Get Frankenstein sample
 def get_frankenstein():
     logger.info("Getting Frankenstein sample")
-    try:
-        with open(r'C:\kuku\Kokoro-TTS\frankenstein5k.md', 'r') as r:
-            text = r.read().strip()
-        logger.debug(f"Loaded Frankenstein sample of length {len(text)}")
-        return text
-    except Exception as e:
-        logger.error(f"Error getting Frankenstein sample: {str(e)}")
-        return "Error loading Frankenstein sample."
+    return _FRANKENSTEIN_TEXT
 
 # Voice choices dictionary
 CHOICES = {
@@ -218,17 +547,89 @@ CHOICES = {
 '🇬🇧 🚹 Lewis': 'bm_lewis',
 '🇬🇧 🚹 Daniel': 'bm_daniel',
 }
+_CHOICES_ITEMS = list(CHOICES.items())
+
+# Preload all voices into shared memory so forked worker processes map a single copy
+def _safe_load(v):
+    try:
+        _pack_for(v).share_memory_()
+        return True
+    except Exception as e:
+        logger.error("Error preloading voice %s: %s", v, e)
+        return False
 
-# Preload all voices
 logger.info("Preloading all voices")
-voice_count = 0
-for v in CHOICES.values():
+with ThreadPoolExecutor(max_workers=min(8, len(CHOICES))) as executor:
+    voice_count = sum(executor.map(_safe_load, CHOICES.values()))
+logger.info("Successfully preloaded %d voices", voice_count)
+
+# Two phoneme strings of unequal length, used to check the batched forward at startup
+def _sample_batch(pack):
+    return [(ps, pack[len(ps)-1], speed) for ps, speed in [('həlˈO wˈɜɹld, ðɪs ɪz kˈOkəɹO.', 1), ('kˈOkəɹO', 1.2)]]
+
+# Check that a padded batch reproduces per-request KModel.forward output; the vocoder
+# draws random noise, so both runs start from the same seed. Run before compiling, since
+# Inductor draws that noise from a different random stream than eager mode
+def _check_batch_parity(batch):
+    with torch.inference_mode(), torch.random.fork_rng():
+        torch.manual_seed(0)
+        expected = [models[False](ps, ref_s, speed) for ps, ref_s, speed in batch]
+        torch.manual_seed(0)
+        actual = _forward_batch(batch, bf16=False)
+    return all(a.shape == b.shape and torch.allclose(a, b, atol=1e-3) for a, b in zip(actual, expected))
+
+_warmup_batch = None
+try:
+    _warmup_batch = _sample_batch(_pack_for('af_heart'))
+except Exception as e:
+    logger.error("Error building warm-up batch: %s", e)
+
+_batch_parity_ok = False
+try:
+    _batch_parity_ok = _warmup_batch is not None and _check_batch_parity(_warmup_batch)
+except Exception as e:
+    logger.error("Error checking batched forward: %s", e)
+if _batch_parity_ok:
+    logger.info("Batched forward matches KModel.forward")
+else:
+    logger.warning("Batched forward does not match KModel.forward, using KModel.forward per request")
+
+# Compile the ALBERT encoder and the vocoder, the two heaviest CPU submodules. torch.compile
+# is lazy, so run the warm-up forward here: a compile failure falls back to eager at startup
+# and no request pays for compilation. Only the verified batched path uses these modules
+if USE_COMPILE and _batch_parity_ok:
     try:
-        pipelines[v[0]].load_voice(v)
-        voice_count += 1
+        _bert = torch.compile(models[False].bert, dynamic=True)
+        _decoder = torch.compile(models[False].decoder, dynamic=True)
+        _forward_batch(_warmup_batch, bf16=False)
+        logger.info("Compiled model submodules with torch.compile")
     except Exception as e:
-        logger.error(f"Error preloading voice {v}: {str(e)}")
-logger.info(f"Successfully preloaded {voice_count} voices")
+        logger.warning("torch.compile failed, using eager modules: %s", e)
+        _bert, _decoder = models[False].bert, models[False].decoder
+
+# bf16 only pays off with native bf16 instructions; elsewhere oneDNN emulates it, which is
+# usually slower than fp32
+def _bf16_unsupported_reason():
+    if not torch.ops.mkldnn._is_mkldnn_bf16_supported():
+        return "oneDNN has no bf16 support on this CPU"
+    if not (getattr(torch.cpu, '_is_avx512_bf16_supported', bool)() or getattr(torch.cpu, '_is_amx_tile_supported', bool)()):
+        return "CPU has neither AVX512_BF16 nor AMX"
+    return None
+
+# Probe bf16 autocast once; it stays off when some op in the forward has no bf16 kernel
+_bf16_ok = False
+if USE_BF16:
+    if not _batch_parity_ok:
+        logger.info("bf16 autocast disabled: batched forward is not in use")
+    elif reason := _bf16_unsupported_reason():
+        logger.info("bf16 autocast disabled: %s", reason)
+    else:
+        try:
+            _forward_batch(_warmup_batch, bf16=True)
+            _bf16_ok = True
+        except RuntimeError as e:
+            logger.warning("bf16 autocast unsupported, using fp32: %s", e)
+logger.info("bf16 autocast enabled: %s", _bf16_ok)
 
 # UI text constants
 TOKEN_NOTE = '''
@@ -271,7 +672,7 @@ with gr.Blocks() as generate_tab:
 
 # Stream tab UI
 with gr.Blocks() as stream_tab:
-    out_stream = gr.Audio(label='Output Audio Stream', interactive=False, streaming=True, autoplay=True)
+    out_stream = gr.Audio(label='Output Audio Stream', interactive=False, streaming=True, autoplay=True, format='wav')
     with gr.Row():
         stream_btn = gr.Button('Stream', variant='primary')
         stop_btn = gr.Button('Stop', variant='stop')
@@ -282,7 +683,7 @@ with gr.Blocks() as stream_tab:
 # Check API settings
 API_OPEN = os.getenv('SPACE_ID') != r'c:\kuku\Kokoro-82M'
 API_NAME = None if API_OPEN else False
-logger.info(f"API settings: open={API_OPEN}")
+logger.info("API settings: open=%s", API_OPEN)
 
 # Main application UI
 with gr.Blocks() as app:
@@ -292,7 +693,7 @@ with gr.Blocks() as app:
         with gr.Column():
             text = gr.Textbox(label='Input Text', info=f"Up to ~500 characters per Generate, or {'∞' if CHAR_LIMIT is None else CHAR_LIMIT} characters per Stream")
             with gr.Row():
-                voice = gr.Dropdown(list(CHOICES.items()), value='af_heart', label='Voice', info='Quality and availability vary by language')
+                voice = gr.Dropdown(_CHOICES_ITEMS, value='af_heart', label='Voice', info='Quality and availability vary by language')
                 use_gpu = gr.Dropdown(
                     [('ZeroGPU 🚀', True), ('CPU 🐌', False)],
                     value=CUDA_AVAILABLE,
@@ -313,18 +714,18 @@ with gr.Blocks() as app:
     random_btn.click(fn=get_random_quote, inputs=[], outputs=[text], api_name=API_NAME)
     gatsby_btn.click(fn=get_gatsby, inputs=[], outputs=[text], api_name=API_NAME)
     frankenstein_btn.click(fn=get_frankenstein, inputs=[], outputs=[text], api_name=API_NAME)
-    generate_btn.click(fn=generate_first, inputs=[text, voice, speed, use_gpu], outputs=[out_audio, out_ps], api_name=API_NAME)
+    generate_btn.click(fn=generate_first, inputs=[text, voice, speed, use_gpu], outputs=[out_audio, out_ps], api_name=API_NAME, concurrency_limit=BATCH_SIZE, concurrency_id='synthesis')
     tokenize_btn.click(fn=tokenize_first, inputs=[text, voice], outputs=[out_ps], api_name=API_NAME)
-    stream_event = stream_btn.click(fn=generate_all, inputs=[text, voice, speed, use_gpu], outputs=[out_stream], api_name=API_NAME)
+    stream_event = stream_btn.click(fn=generate_all, inputs=[text, voice, speed, use_gpu], outputs=[out_stream], api_name=API_NAME, concurrency_limit=BATCH_SIZE, concurrency_id='synthesis')
     stop_btn.click(fn=None, cancels=stream_event)
-    predict_btn.click(fn=predict, inputs=[text, voice, speed], outputs=[out_audio], api_name=API_NAME)
+    predict_btn.click(fn=predict, inputs=[text, voice, speed], outputs=[out_audio], api_name=API_NAME, concurrency_limit=BATCH_SIZE, concurrency_id='synthesis')
 
 # Launch the application
 if __name__ == '__main__':
     logger.info("Launching application")
     try:
-        app.queue(api_open=API_OPEN).launch(show_api=API_OPEN, ssr_mode=True)
+        app.queue(default_concurrency_limit=BATCH_SIZE, max_size=64, api_open=API_OPEN).launch(show_api=API_OPEN, ssr_mode=False)
         logger.info("Application started successfully")
     except Exception as e:
-        logger.critical(f"Failed to start application: {str(e)}")
+        logger.critical("Failed to start application: %s", e)
         raise